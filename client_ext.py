@@ -1,10 +1,19 @@
-import json
+import inspect
+import io
 from typing import List, Optional, Union, Dict
 
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
 import cellengine
-import pandas
 from cellengine import Compensations, UNCOMPENSATED
-from pandas import DataFrame
+
+# When the toolkit's _post forwards a raw body, serialize it ourselves with
+# orjson instead of going through requests' stdlib-json path
+_POST_PARAMS = inspect.signature(cellengine.APIClient._post).parameters
+_POST_ACCEPTS_RAW_BODY = "data" in _POST_PARAMS and "headers" in _POST_PARAMS
 
 
 def get_statistics(
@@ -20,8 +29,9 @@ def get_statistics(
         layout: Optional[str] = None,
         percent_of: Optional[Union[str, List[str]]] = "PARENT",
         population_ids: Optional[List[str]] = None,
+        raw_bytes: bool = False,
         other_params: dict = {}
-) -> Union[Dict, str, DataFrame]:
+) -> Union[Dict, str, bytes, "pandas.DataFrame"]:
     """
     Request Statistics from CellEngine.
 
@@ -57,9 +67,11 @@ def get_statistics(
             those populations.
         population_ids: List[str]: List of population IDs.
             Defaults to ungated.
+        raw_bytes: For TSV/CSV formats, return the response bytes as-is
+            instead of decoding to str (defaults to False).
 
     Returns:
-        statistics: Dict, String, or pandas.Dataframe
+        statistics: Dict, String, bytes, or pandas.Dataframe
     """
 
     if "quantile" == statistics and not isinstance(q, float):
@@ -72,7 +84,7 @@ def get_statistics(
         "annotations": annotations,
         "compensationId": compensation_id,
         "fcsFileIds": fcs_file_ids,
-        "format": "json" if format == "pandas" else format,
+        "format": "TSV (with header)" if format == "pandas" else format,
         "layout": layout,
         "percentOf": percent_of,
         "populationIds": population_ids
@@ -81,23 +93,37 @@ def get_statistics(
 
     req_params = {key: val for key, val in params.items() if val is not None}
 
-    raw_stats = client._post(
-        f"{client.base_url}/api/v1/experiments/{experiment_id}/bulkstatistics",
-        json=req_params,
-        raw=True,
-    )
+    url = f"{client.base_url}/api/v1/experiments/{experiment_id}/bulkstatistics"
+    if _POST_ACCEPTS_RAW_BODY:
+        raw_stats = client._post(
+            url,
+            data=_json.dumps(req_params),
+            headers={"Content-Type": "application/json"},
+            raw=True,
+        )
+    else:
+        raw_stats = client._post(
+            url,
+            json=req_params,
+            raw=True,
+        )
 
     format = format.lower()
     if format == "json":
-        return json.loads(raw_stats)
+        return _json.loads(raw_stats)
     elif "sv" in format:
         try:
+            if raw_bytes:
+                return raw_stats
             return raw_stats.decode()
         except Exception as e:
             raise ValueError("Invalid output format {}".format(format), e)
     elif format == "pandas":
         try:
-            return pandas.DataFrame.from_dict(json.loads(raw_stats))
+            import pandas
+
+            raw = raw_stats if isinstance(raw_stats, bytes) else raw_stats.encode()
+            return pandas.read_csv(io.BytesIO(raw), sep="\t")
         except Exception as e:
             raise ValueError("Invalid data format {} for pandas".format(format), e)
     else:
@@ -1,53 +1,158 @@
+import functools
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from typing import Optional
 
 import cellengine
 import os
-import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter, Retry
 
 from cellengine import Experiment, FcsFile
 
-import utils
 from client_ext import get_statistics
-from params import logger
-from s3 import S3FilesLoader
+from params import configure_logger, load_envs, logger
 
 
-client = cellengine.APIClient()
+client: Optional[cellengine.APIClient] = None
+s3_files_loader = None
 
 
-s3_files_loader = S3FilesLoader(
-    bucket="rnd-immune-profiling",
-    region_name="us-east-1",
-    endpoint_url=None,
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_KEY"),
-)
+def _init_clients():
+    """Create the CellEngine and S3 clients on first use, so merely importing
+    this module (test collection, linters) stays cheap."""
+    global client, s3_files_loader
+
+    if client is None:
+        configure_logger()
+        load_envs()
+
+        client = cellengine.APIClient()
+
+        # The toolkit keeps its authenticated session (token cookie) in
+        # requests_session; mount the pooled adapter on that one so _get/_post
+        # reuse warm connections instead of paying a TLS handshake each.
+        _client_session = getattr(client, "requests_session", None)
+        if _client_session is None:
+            _client_session = requests.Session()
+            client.requests_session = _client_session
+
+        _client_session.mount("https://", HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+        ))
+        _client_session.headers.update({"Connection": "keep-alive"})
+
+    if s3_files_loader is None:
+        from s3 import S3FilesLoader
+
+        s3_files_loader = S3FilesLoader(
+            bucket="rnd-immune-profiling",
+            region_name="us-east-1",
+            endpoint_url=None,
+            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+            aws_secret_access_key=os.getenv("AWS_SECRET_KEY"),
+        )
+
+
+_existing_s3_keys: set[str] = set()
 
-def _check_s3_exists(f_path: str) -> bool:
-    exists = s3_files_loader.check_exists(
-        f_key=f"CellEngine/{f_path}"
-    )
 
-    if exists:
+def _check_s3_exists(f_path: str) -> bool:
+    if f"CellEngine/{f_path}" in _existing_s3_keys:
         logger.info(f"File exists on s3: {f_path}")
         return True
 
     return False
 
-def _upload_to_s3(f_path: Optional[str], remove_local: bool = False):
-    if f_path is None:
-        return
 
-    s3_files_loader.upload_file(
-        from_filename=f_path,
-        to_f_key=f"CellEngine/{f_path}"
-    )
+_upload_pool = ThreadPoolExecutor(max_workers=8)
+_upload_futures: list[Future] = []
+
+UPLOAD_MAX_ATTEMPTS = 3
+
+
+def _upload_with_retry(f_path: str, remove_local: bool):
+    for attempt in range(UPLOAD_MAX_ATTEMPTS):
+        try:
+            s3_files_loader.upload_file(
+                from_filename=f_path,
+                to_f_key=f"CellEngine/{f_path}"
+            )
+            _existing_s3_keys.add(f"CellEngine/{f_path}")
+            break
+        except Exception as e:
+            if attempt == UPLOAD_MAX_ATTEMPTS - 1:
+                raise
+
+            backoff = 2 ** attempt
+            logger.info(f"Upload failed ({attempt + 1}/{UPLOAD_MAX_ATTEMPTS}), retry in {backoff}s: {f_path}: {e}")
+            time.sleep(backoff)
 
     if remove_local:
         logger.info(f"Remove: {f_path}")
         os.remove(f_path)
 
 
+def _upload_to_s3(f_path: Optional[str], remove_local: bool = False) -> Optional[Future]:
+    if f_path is None:
+        return None
+
+    future = _upload_pool.submit(_upload_with_retry, f_path, remove_local)
+    _upload_futures.append(future)
+
+    return future
+
+
+def _upload_bytes_with_retry(f_path: str, data: bytes):
+    for attempt in range(UPLOAD_MAX_ATTEMPTS):
+        try:
+            s3_files_loader.upload_bytes(
+                data=data,
+                to_f_key=f"CellEngine/{f_path}"
+            )
+            _existing_s3_keys.add(f"CellEngine/{f_path}")
+            break
+        except Exception as e:
+            if attempt == UPLOAD_MAX_ATTEMPTS - 1:
+                raise
+
+            backoff = 2 ** attempt
+            logger.info(f"Upload failed ({attempt + 1}/{UPLOAD_MAX_ATTEMPTS}), retry in {backoff}s: {f_path}: {e}")
+            time.sleep(backoff)
+
+
+def _upload_bytes_to_s3(named_data: Optional[tuple[str, bytes]]) -> Optional[Future]:
+    if named_data is None:
+        return None
+
+    f_path, data = named_data
+    future = _upload_pool.submit(_upload_bytes_with_retry, f_path, data)
+    _upload_futures.append(future)
+
+    return future
+
+
+def _wait_uploads():
+    n = len(_upload_futures)
+
+    while _upload_futures:
+        _upload_futures.pop().result()
+
+    if n > 0:
+        logger.info(f"Finished {n} pending uploads")
+
+
+def _stream_to_file(session: requests.Session, url: str, f_path: str, chunk_size: int = 1 << 20):
+    response = session.get(url, stream=True)
+    response.raise_for_status()
+
+    with open(f_path, "wb") as f:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            f.write(chunk)
+
+
 def _download_file(exp: Experiment, exp_root: str, fcs_file: FcsFile) -> Optional[str]:
     logger.info(f"download_file")
 
@@ -55,27 +160,53 @@ def _download_file(exp: Experiment, exp_root: str, fcs_file: FcsFile) -> Optiona
     if _check_s3_exists(f_path=fcs_file_path):
         return None
 
-    binary_file = client.download_fcs_file(exp.id, fcs_file.id)
-
-    with open(fcs_file_path, "wb") as f:
-        f.write(binary_file)
+    # Stream through the client's authenticated session; only that session
+    # carries the CellEngine token cookie. Without one, fall back to the
+    # toolkit's in-memory download rather than an unauthenticated GET.
+    session = getattr(client, "requests_session", None)
+    if session is not None:
+        _stream_to_file(
+            session=session,
+            url=f"{client.base_url}/api/v1/experiments/{exp.id}/fcsfiles/{fcs_file.id}.fcs",
+            f_path=fcs_file_path
+        )
+    else:
+        binary_file = client.download_fcs_file(exp.id, fcs_file.id)
+
+        with open(fcs_file_path, "wb") as f:
+            f.write(binary_file)
 
     return fcs_file_path
 
 
-def _download_global_gating_ml(exp: Experiment, exp_root: str) -> str:
-    logger.info(f"download_global_gating_ml")
+# Read-only GETs, memoized by experiment id so partial reruns within one
+# process do not repeat the round-trip.
+@functools.lru_cache(maxsize=256)
+def _get_global_gating_ml(exp_id: str) -> bytes:
+    return client._get(url=f"{client.base_url}/api/v1/experiments/{exp_id}.gatingml", raw=True)
+
+
+@functools.lru_cache(maxsize=256)
+def _get_statistics_with_annotations(exp_id: str) -> list[dict]:
+    return get_statistics(
+        client=client,
+        experiment_id=exp_id,
+        statistics=[],
+        channels=[],
+        format="json",
+        annotations=True
+    )
 
-    response = client._get(url=f"{client.base_url}/api/v1/experiments/{exp.id}.gatingml", raw=True)
+
+def _download_global_gating_ml(exp: Experiment, exp_root: str) -> tuple[str, bytes]:
+    logger.info(f"download_global_gating_ml")
 
     gatingml_file_path = f"{exp_root}/{exp.name}_global.gatingml"
-    with open(gatingml_file_path, "wb") as f:
-        f.write(response)
 
-    return gatingml_file_path
+    return gatingml_file_path, _get_global_gating_ml(exp.id)
 
 
-def _download_fcs_gating_ml(exp: Experiment, exp_root: str, fcs_file: FcsFile) -> Optional[str]:
+def _download_fcs_gating_ml(exp: Experiment, exp_root: str, fcs_file: FcsFile) -> Optional[tuple[str, bytes]]:
     logger.info(f"download_fcs_gating_ml")
 
     fcs_name = fcs_file.name.removesuffix(".fcs")
@@ -85,14 +216,10 @@ def _download_fcs_gating_ml(exp: Experiment, exp_root: str, fcs_file: FcsFile) -
 
     response = client._get(url=f"{client.base_url}/api/v1/experiments/{exp.id}.gatingml?fcsFileId={fcs_file.id}", raw=True)
 
+    return gatingml_file_path, response
 
-    with open(gatingml_file_path, "wb") as f:
-        f.write(response)
-
-    return gatingml_file_path
 
-
-def _download_statistics(exp: Experiment, exp_root: str, fcs_file: FcsFile) -> str:
+def _download_statistics(exp: Experiment, exp_root: str, fcs_file: FcsFile, all_populations: list[str]) -> Optional[tuple[str, bytes]]:
     logger.info(f"download_statistics")
 
     fcs_name = fcs_file.name.removesuffix(".fcs")
@@ -100,10 +227,7 @@ def _download_statistics(exp: Experiment, exp_root: str, fcs_file: FcsFile) -> s
     if _check_s3_exists(f_path=statistics_file_path):
         return None
 
-    all_populations = [""]
-    all_populations.extend([pop.id for pop in exp.populations])
-
-    statistics_tsv = get_statistics(
+    statistics_tsv: bytes = get_statistics(
         client=client,
         experiment_id=exp.id,
         statistics=["eventcount"],
@@ -112,6 +236,7 @@ def _download_statistics(exp: Experiment, exp_root: str, fcs_file: FcsFile) -> s
         format="TSV (with header)",
         layout="medium",
         population_ids=all_populations,
+        raw_bytes=True,
         other_params={
             "ids": True,
             "uniqueNames": True,
@@ -119,69 +244,81 @@ def _download_statistics(exp: Experiment, exp_root: str, fcs_file: FcsFile) -> s
         }
     )
 
-    with open(statistics_file_path, "w", encoding="utf-8", newline='\n') as f:
-        f.write(statistics_tsv)
+    return statistics_file_path, statistics_tsv
+
+
+def _process_one_fcs(exp: Experiment, exp_root: str, fcs_file: FcsFile, all_populations: list[str], info: str):
+    with logger.contextualize(fcs=info):
+        fcs_f_path = _download_file(exp, exp_root, fcs_file)
+        _upload_to_s3(f_path=fcs_f_path, remove_local=True)
 
-    return statistics_file_path
+        fcs_gating_ml = _download_fcs_gating_ml(exp, exp_root, fcs_file)
+        _upload_bytes_to_s3(named_data=fcs_gating_ml)
+
+        statistics = _download_statistics(exp, exp_root, fcs_file, all_populations)
+        _upload_bytes_to_s3(named_data=statistics)
 
 
 def _download_experiment_files(exp: Experiment):
     exp_root = f"data/{exp.name}"
     os.makedirs(exp_root, exist_ok=True)
 
-    global_gating_ml_f_path = _download_global_gating_ml(exp, exp_root)
+    # The prefix LIST and the gatingml GET hit different services; start them
+    # concurrently (the upload pool is idle here) and join before the per-file
+    # existence checks need the key set
+    list_keys_future = _upload_pool.submit(s3_files_loader.list_keys_under, f"CellEngine/{exp_root}/")
 
-    _upload_to_s3(f_path=global_gating_ml_f_path)
+    global_gating_ml = _download_global_gating_ml(exp, exp_root)
 
-    n = len(exp.fcs_files)
-    for idx, fcs_file in enumerate(exp.fcs_files, 1):
-        with logger.contextualize(fcs=f"({idx}/{n}) {fcs_file.name} "):
-            fcs_f_path = _download_file(exp, exp_root, fcs_file)
-            _upload_to_s3(f_path=fcs_f_path, remove_local=True)
+    _existing_s3_keys.update(list_keys_future.result())
 
-            fcs_gating_ml_f_path = _download_fcs_gating_ml(exp, exp_root, fcs_file)
-            # utils.compare_files(file1_path=global_gating_ml_f_path, file2_path=fcs_gating_ml_f_path)
+    _upload_bytes_to_s3(named_data=global_gating_ml)
 
-            _upload_to_s3(f_path=fcs_gating_ml_f_path, remove_local=True)
+    # Experiment attributes can be lazy; resolve them once instead of per file
+    fcs_files = list(exp.fcs_files)
+    all_populations = [""]
+    all_populations.extend([pop.id for pop in exp.populations])
 
-            statistics_f_path = _download_statistics(exp, exp_root, fcs_file)
-            _upload_to_s3(f_path=statistics_f_path, remove_local=True)
+    n = len(fcs_files)
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        future_to_fcs_file = {
+            executor.submit(
+                _process_one_fcs, exp, exp_root, fcs_file, all_populations, f"({idx}/{n}) {fcs_file.name} "
+            ): fcs_file
+            for idx, fcs_file in enumerate(fcs_files, 1)
+        }
 
+        for n_done, future in enumerate(as_completed(future_to_fcs_file), 1):
+            future.result()
+            logger.info(f"Processed fcs file: ({n_done}/{n}) {future_to_fcs_file[future].name}")
 
+    _wait_uploads()
 
 
-def _extract_experiment_annotations(exp: Experiment) -> pd.DataFrame:
-    logger.info(f"extract_experiment_annotations")
+def _extract_experiment_annotations(exp: Experiment) -> "pd.DataFrame":
+    import pandas as pd
 
-    statistics_with_annotations: dict = get_statistics(
-        client=client,
-        experiment_id=exp.id,
-        statistics=[],
-        channels=[],
-        format="json",
-        annotations=True
-    )
-
-    exp_annotations = []
-    for statistic in statistics_with_annotations:
-        fcs_annotations = {
-            "experiment": exp.name,
-            "filename": statistic["filename"]
-        }
-        fcs_annotations.update(statistic["annotations"])
+    logger.info(f"extract_experiment_annotations")
 
-        exp_annotations.append(fcs_annotations)
+    statistics_with_annotations = _get_statistics_with_annotations(exp.id)
 
-    exp_df = pd.DataFrame(data=exp_annotations)
+    exp_df = pd.DataFrame.from_records([
+        {"experiment": exp.name, "filename": statistic["filename"], **statistic["annotations"]}
+        for statistic in statistics_with_annotations
+    ])
 
     return exp_df
 
 
 def process_experiments(experiments):
+    import pandas as pd
+
+    _init_clients()
+
     experiment_names = [exp.name for exp in experiments]
     logger.info(f"Process experiments: {experiment_names}")
 
-    annotations_df = pd.DataFrame()
+    annotations_frames: list[pd.DataFrame] = []
 
     n = len(experiments)
     for idx, exp in enumerate(experiments, 1):
@@ -189,14 +326,22 @@ def process_experiments(experiments):
             _download_experiment_files(exp)
 
             experiment_annotations_df = _extract_experiment_annotations(exp=exp)
-            annotations_df = pd.concat([annotations_df, experiment_annotations_df])
+            annotations_frames.append(experiment_annotations_df)
+
+    annotations_df = pd.concat(annotations_frames or [pd.DataFrame()], ignore_index=True)
 
     annotations_f_path = "data/Annotations.xlsx"
-    annotations_df.to_excel(annotations_f_path, index=False)
+    # No constant_memory here: pandas emits body cells column-by-column and
+    # xlsxwriter's row-flushing mode silently drops writes to flushed rows
+    with pd.ExcelWriter(annotations_f_path, engine='xlsxwriter') as writer:
+        annotations_df.to_excel(writer, index=False, sheet_name='Annotations')
     _upload_to_s3(f_path=annotations_f_path, remove_local=True)
+    _wait_uploads()
 
 
 def process_experiments_by_names(experiment_names: list[str]):
+    _init_clients()
+
     experiments = []
     for exp_name in experiment_names:
         exp = client.get_experiment(name=exp_name)
@@ -231,4 +376,5 @@ def main():
     process_experiments_by_names(experiments)
 
 
-main()
+if __name__ == "__main__":
+    main()
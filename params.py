@@ -8,11 +8,22 @@ LOGGER_FORMAT = "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | " + \
                 "<level>{level: <8}</level> | " + \
                 "<green>{extra}</green><level>: {message}</level>"
 
-logger.remove(0)
-logger.add(sink="logs/log.log", level="INFO", format=LOGGER_FORMAT, backtrace=False, diagnose=False, rotation='1 GB')
-logger.add(sys.stdout, level="INFO", format=LOGGER_FORMAT, backtrace=False, diagnose=False)
-
 DOTENV_PATH = "dev.env"
 
-load_dotenv(dotenv_path=DOTENV_PATH)
-logger.info(f"Loaded envs from {DOTENV_PATH}: {dotenv_values(dotenv_path=DOTENV_PATH)}")
+_logger_configured = False
+
+
+def configure_logger():
+    global _logger_configured
+    if _logger_configured:
+        return
+    _logger_configured = True
+
+    logger.remove()
+    logger.add(sink="logs/log.log", level="INFO", format=LOGGER_FORMAT, backtrace=False, diagnose=False, rotation='1 GB')
+    logger.add(sys.stdout, level="INFO", format=LOGGER_FORMAT, backtrace=False, diagnose=False)
+
+
+def load_envs(dotenv_path: str = DOTENV_PATH):
+    load_dotenv(dotenv_path=dotenv_path)
+    logger.info(f"Loaded envs from {dotenv_path}: {dotenv_values(dotenv_path=dotenv_path)}")
@@ -1,12 +1,14 @@
 # mypy: ignore-errors
 
+import io
 import os
 from pathlib import Path
 from typing import Optional, Union, BinaryIO
 
 import boto3
-from s3transfer.manager import TransferManager
+from s3transfer.manager import TransferConfig, TransferManager
 from botocore.config import Config
+from botocore.exceptions import ClientError
 from s3transfer.subscribers import BaseSubscriber
 
 from params import logger
@@ -30,12 +32,21 @@ class S3FilesLoader:
             endpoint_url=endpoint_url,
             aws_access_key_id=aws_access_key_id,
             aws_secret_access_key=aws_secret_access_key,
-            config=Config()
+            config=Config(
+                max_pool_connections=64,
+                retries={'max_attempts': 10, 'mode': 'adaptive'},
+                tcp_keepalive=True
+            )
         )
 
         self.s3_client = self.s3_resource.meta.client
 
-        self.s3_transfer_manager = TransferManager(client=self.s3_client)
+        transfer_config = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=16 * 1024 * 1024,
+            max_request_concurrency=16
+        )
+        self.s3_transfer_manager = TransferManager(client=self.s3_client, config=transfer_config)
         self.bucket_name = bucket
         self.bucket = self.s3_resource.Bucket(self.bucket_name)
 
@@ -72,6 +83,23 @@ class S3FilesLoader:
         else:
             logger.info(f"{info}: DRY_RUN: skip")
 
+    def upload_bytes(self, data: Union[bytes, BinaryIO], to_f_key: str, info: str = "") -> None:
+        if isinstance(data, bytes):
+            logger.info(f"{info}: Upload {len(data)} bytes to s3: -> {to_f_key}")
+            data = io.BytesIO(data)
+        else:
+            logger.info(f"{info}: Upload bytes to s3: -> {to_f_key}")
+
+        if self.is_not_dry_run():
+            self.s3_transfer_manager.upload(
+                fileobj=data,
+                bucket=self.bucket_name,
+                key=to_f_key,
+                subscribers=None
+            ).result()
+        else:
+            logger.info(f"{info}: DRY_RUN: skip")
+
     def add_to_upload_future(self, from_filename: str, to_f_key: str, info: str = "") -> None:
         logger.info(f"{info}: Add to upload file to s3 as future: {from_filename} -> {to_f_key}")
 
@@ -202,6 +230,27 @@ class S3FilesLoader:
         else:
             logger.info(f"{info}: DRY_RUN: skip")
 
+    def add_to_copy_future(self, from_f_key: str, to_f_key: str, to_bucket: str = None, info: str = "") -> None:
+        if not to_bucket:
+            to_bucket = self.bucket_name
+
+        logger.info(
+            f"{info}: Add to copy file on s3 as future: "
+            f"s3://{self.bucket_name}/{from_f_key} -> s3://{to_bucket}/{to_f_key}"
+        )
+
+        if self.is_not_dry_run():
+            self.__future_queue.append(
+                self.s3_transfer_manager.copy(
+                    copy_source={'Bucket': self.bucket_name, 'Key': from_f_key},
+                    bucket=to_bucket,
+                    key=to_f_key,
+                    subscribers=None
+                )
+            )
+        else:
+            logger.info(f"{info}: DRY_RUN: skip")
+
     def copy_dir(self, from_dir_key: str, to_dir_key: str, to_bucket: str = None, info: str = "") -> None:
         if not to_bucket:
             to_bucket = self.bucket_name
@@ -212,7 +261,11 @@ class S3FilesLoader:
         num_objs = len(objs)
         for i, obj in enumerate(objs, 1):
             new_key = obj.key.replace(from_dir_key, to_dir_key, 1)
-            self.copy_file(from_f_key=obj.key, to_f_key=new_key, to_bucket=to_bucket, info=f"{info} ({i}/{num_objs})")
+            self.add_to_copy_future(
+                from_f_key=obj.key, to_f_key=new_key, to_bucket=to_bucket, info=f"{info} ({i}/{num_objs})"
+            )
+
+        self.result_all_futures()
 
     def move_dir(
             self,
@@ -227,6 +280,10 @@ class S3FilesLoader:
 
         logger.info(f"{info}: Move dir: s3://{self.bucket_name}/{from_dir_key} -> s3://{to_bucket}/{to_dir_key}")
 
+        if to_bucket == self.bucket_name and from_dir_key == to_dir_key:
+            logger.info(f"{info}: Cannot move files! from_dir_key=to_dir_key={to_dir_key}")
+            return
+
         objs = list(self.bucket.objects.filter(Prefix=from_dir_key))
         num_objs = len(objs)
 
@@ -239,7 +296,11 @@ class S3FilesLoader:
 
         for _i, obj in enumerate(objs, 1):
             new_key = obj.key.replace(from_dir_key, to_dir_key, 1)
-            self.move_file(from_f_key=obj.key, to_f_key=new_key, to_bucket=to_bucket)
+            self.add_to_copy_future(from_f_key=obj.key, to_f_key=new_key, to_bucket=to_bucket, info=info)
+
+        self.result_all_futures()
+
+        self._delete_objects_batched(objs=objs, info=info)
 
     def delete_dir(self, dir_key: str, max_obj_count: int = 30, info: str = "") -> None:
         logger.info(f"{info}: Delete dir on s3: {dir_key}. Max Count: {max_obj_count}")
@@ -256,8 +317,32 @@ class S3FilesLoader:
                 f"You can increase max_obj_count. !!! Be carefully - you can delete objects without recovery"
             )
 
-        for i, obj in enumerate(objs, 1):
-            self.delete_file(f_key=obj.key, info=f"{info} ({i}/{num_objs})")
+        self._delete_objects_batched(objs=objs, info=info)
+
+    def _delete_objects_batched(self, objs: list, info: str = "") -> None:
+        num_objs = len(objs)
+
+        # delete_objects accepts up to 1000 keys per request
+        for start in range(0, num_objs, 1000):
+            batch = objs[start:start + 1000]
+            logger.info(f"{info}: Delete batch on s3: ({start + len(batch)}/{num_objs})")
+
+            if self.is_not_dry_run():
+                response = self.s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={
+                        'Objects': [{'Key': obj.key} for obj in batch],
+                        'Quiet': True
+                    }
+                )
+
+                # Per-key failures come back in 'Errors' with HTTP 200, they do not raise
+                errors = response.get('Errors')
+                if errors:
+                    failed = ", ".join(f"{err.get('Key')}: {err.get('Code')}" for err in errors)
+                    raise Exception(f"{info}: Unable to delete {len(errors)} objects: {failed}")
+            else:
+                logger.info(f"{info}: DRY_RUN: skip")
 
     def delete_file(self, f_key: str, info: str = "") -> None:
         logger.info(f"{info} Delete file on s3: {f_key}")
@@ -267,11 +352,26 @@ class S3FilesLoader:
         else:
             logger.info(f"{info}: DRY_RUN: skip")
 
-    def check_exists(self, f_key: str) -> bool:
-        result = self.s3_client.list_objects_v2(Bucket=self.bucket_name, Prefix=f_key, MaxKeys=1)
-        contents = result.get('Contents')
+    def list_keys_under(self, prefix: str) -> set[str]:
+        logger.info(f"List keys on s3 under: {prefix}")
 
-        return contents is not None
+        keys = set()
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                keys.add(obj['Key'])
+
+        logger.info(f"Found {len(keys)} keys under: {prefix}")
+        return keys
+
+    def check_exists(self, f_key: str) -> bool:
+        try:
+            self.s3_client.head_object(Bucket=self.bucket_name, Key=f_key)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
 
     def list_objects(self, f_key: str) -> list[dict]:
         result = self.s3_client.list_objects_v2(Bucket=self.bucket_name, Prefix=f_key)